@@ -0,0 +1,80 @@
+"""Here the retriever cache is defined. This cache is used to skip the vectorstore search for repeated or semantically equal questions."""
+import functools
+import threading
+from collections.abc import Callable, Sequence
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+
+
+class SemanticRetrieverCache:
+
+    """Retriever with an exact and a semantic cache in front of a vectorstore.
+
+    Exact repeats of a question are answered from a LRU cache. Other questions are embedded once and compared to the questions
+    seen so far, if the cosine similarity reaches the threshold the cached documents are returned without searching the vectorstore.
+    """
+
+    def __init__(self, vectorstore: VectorStore, embed_query: Callable[[str], Sequence[float]], k: int = 4, threshold: float = 0.95, maxsize: int = 256) -> None:  # noqa: PLR0913, k, threshold and maxsize are optional tuning knobs with defaults
+        """Initialize the cache.
+
+        Args:
+        ----
+            vectorstore (VectorStore): Vectorstore to search on a cache miss
+            embed_query (Callable[[str], Sequence[float]]): Function to embed the questions
+            k (int): Number of documents to retrieve
+            threshold (float): Minimum cosine similarity for a semantic cache hit
+            maxsize (int): Maximum number of cached questions
+
+        """
+        self.vectorstore = vectorstore
+        self.embed_query = embed_query
+        self.k = k
+        self.threshold = threshold
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        # Ring buffer of the cached questions, the key matrix is allocated once the embedding size is known
+        self._keys: np.ndarray | None = None
+        self._results: list[list[Document] | None] = [None] * maxsize
+        self._size = 0
+        self._next = 0
+        self._exact = functools.lru_cache(maxsize=maxsize)(self._search)
+
+    def invoke(self, question: str) -> list[Document]:
+        """Retrieve the documents for a question.
+
+        Args:
+        ----
+            question (str): The user question
+
+        Returns:
+        -------
+            list[Document]: Retrieved documents
+
+        """
+        return list(self._exact(question))
+
+    def _search(self, question: str) -> list[Document]:
+        """Look up a question in the semantic cache and search the vectorstore on a miss."""
+        vector = np.asarray(self.embed_query(question), dtype=np.float32)
+        vector /= np.linalg.norm(vector)
+
+        with self._lock:
+            if self._size:
+                similarities = self._keys[: self._size] @ vector
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    return self._results[best]
+
+        # Reuse the question embedding instead of embedding it again in the retriever
+        documents = self.vectorstore.similarity_search_by_vector(vector.tolist(), k=self.k)
+
+        with self._lock:
+            if self._keys is None:
+                self._keys = np.zeros((self.maxsize, vector.shape[0]), dtype=np.float32)
+            self._keys[self._next] = vector
+            self._results[self._next] = documents
+            self._next = (self._next + 1) % self.maxsize
+            self._size = min(self._size + 1, self.maxsize)
+        return documents
@@ -0,0 +1,95 @@
+"""Here the shared Cohere connection pools are defined. These pools are used by all Cohere models to reuse their connections."""
+import asyncio
+import functools
+import weakref
+from typing import TypeVar
+
+import cohere
+import httpx
+from langchain_cohere import ChatCohere
+from langchain_core.pydantic_v1 import SecretStr
+from langchain_core.utils import get_from_env
+
+T = TypeVar("T")
+
+LIMITS = httpx.Limits(max_connections=64, max_keepalive_connections=32, keepalive_expiry=60)
+TIMEOUT = httpx.Timeout(300)
+
+
+@functools.cache
+def get_http_client() -> httpx.Client:
+    """Get the shared connection pool for the Cohere clients."""
+    return httpx.Client(limits=LIMITS, timeout=TIMEOUT)
+
+
+class EventLoopTransport(httpx.AsyncBaseTransport):
+
+    """Transport with one connection pool per event loop.
+
+    Async connections are bound to the event loop they were opened in, so a single pool breaks as soon as a second event loop
+    uses it, like a second asyncio.run or an event loop per server thread. The pool of an event loop is dropped with the loop.
+    """
+
+    def __init__(self) -> None:
+        """Initialize the transport."""
+        self._transports: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncHTTPTransport] = weakref.WeakKeyDictionary()
+
+    def get_transport(self) -> httpx.AsyncHTTPTransport:
+        """Get the connection pool of the running event loop."""
+        loop = asyncio.get_running_loop()
+        if loop not in self._transports:
+            self._transports[loop] = httpx.AsyncHTTPTransport(limits=LIMITS)
+        return self._transports[loop]
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        """Send a request with the connection pool of the running event loop."""
+        return await self.get_transport().handle_async_request(request)
+
+    async def aclose(self) -> None:
+        """Close the connection pool of the running event loop."""
+        transport = self._transports.pop(asyncio.get_running_loop(), None)
+        if transport is not None:
+            await transport.aclose()
+
+
+@functools.cache
+def get_async_http_client() -> httpx.AsyncClient:
+    """Get the shared connection pools for the async Cohere clients, each event loop uses its own pool."""
+    return httpx.AsyncClient(transport=EventLoopTransport(), timeout=TIMEOUT)
+
+
+def share_connections(model: T) -> T:
+    """Replace the clients of a Cohere model with clients that use the shared connection pools.
+
+    The api key, base url, timeout and user agent configured on the model are kept.
+
+    Args:
+    ----
+        model (T): ChatCohere, CohereEmbeddings or CohereRerank model
+
+    Returns:
+    -------
+        T: The model using the shared connection pools
+
+    """
+    # CohereEmbeddings and CohereRerank only keep the api key if it was passed explicitly, like them fall back to the environment
+    api_key = model.cohere_api_key or get_from_env("cohere_api_key", "COHERE_API_KEY")
+    if isinstance(api_key, SecretStr):
+        api_key = api_key.get_secret_value()
+    settings = {
+        "api_key": api_key,
+        "base_url": getattr(model, "base_url", None),
+        "client_name": model.user_agent,
+        "timeout": getattr(model, "timeout_seconds", None) or getattr(model, "request_timeout", None),
+    }
+
+    model.client = cohere.Client(**settings, httpx_client=get_http_client())
+    if hasattr(model, "async_client"):
+        model.async_client = cohere.AsyncClient(**settings, httpx_client=get_async_http_client())
+    return model
+
+
+@functools.cache
+def get_llm() -> ChatCohere:
+    """Get the shared chat model, chains bind their preamble or output schema to it instead of creating their own model."""
+    return share_connections(ChatCohere(model="command-r", temperature=0))
@@ -1,10 +1,13 @@
 """Here the fallback chain is defined. This chain is used when the main chain fails to generate an answer."""
 from langchain.chains.base import Chain
-from langchain_cohere import ChatCohere
-from langchain_core.messages import HumanMessage
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import ChatPromptTemplate
 
+from rag.components.client import get_llm
+
+# Prompt, built once and only formatted per call
+PROMPT = ChatPromptTemplate.from_messages([("human", "Question: {question} \nAnswer: ")])
+
 
 def generate_fallback_chain() -> Chain:
     """Generates a fallback chain to generate answers based on retrieved documents."""
@@ -14,11 +17,7 @@ def generate_fallback_chain() -> Chain:
     )
 
     # LLM
-    llm = ChatCohere(model_name="command-r", temperature=0).bind(preamble=preamble)
-
-    # Prompt
-    def prompt(x: dict) -> ChatPromptTemplate:
-        return ChatPromptTemplate.from_messages([HumanMessage(f"Question: {x['question']} \nAnswer: ")])
+    llm = get_llm().bind(preamble=preamble)
 
     # Chain
-    return prompt | llm | StrOutputParser()
+    return PROMPT | llm | StrOutputParser()
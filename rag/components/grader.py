@@ -1,41 +1,22 @@
 """Here the grader chains are defined. These chains are used to grade the quality of the generated answers, documents and halluzinations."""
 from langchain.chains.base import Chain
-from langchain_cohere import ChatCohere
+from langchain_cohere import CohereRerank
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.pydantic_v1 import BaseModel, Field
 
+from rag.components.client import get_llm, share_connections
 
-# Data model
-def generate_document_grader() -> Chain:
-    """Generates a grader chain to assess relevance of a retrieved document to a user question.
+
+def generate_document_grader() -> CohereRerank:
+    """Generates a reranker to assess relevance of retrieved documents to a user question.
+
+    The rerank model is a cross-encoder that scores all documents in a single request.
 
     Returns
     -------
-        chain: Grader chain to assess relevance of a retrieved document to a user question.
+        reranker: Reranker to assess relevance of retrieved documents to a user question.
     """
-
-    class GradeDocuments(BaseModel):
-
-        """Binary score for relevance check on retrieved documents."""
-
-        binary_score: str = Field(description="Documents are relevant to the question, 'yes' or 'no'")
-
-    # Prompt
-    preamble = """You are a grader assessing relevance of a retrieved document to a user question. \n
-    If the document contains keyword(s) or semantic meaning related to the user question, grade it as relevant. \n
-    Give a binary score 'yes' or 'no' score to indicate whether the document is relevant to the question."""
-
-    # LLM with function call
-    llm = ChatCohere(model="command-r", temperature=0)
-    structured_llm_grader = llm.with_structured_output(GradeDocuments, preamble=preamble)
-
-    grade_prompt = ChatPromptTemplate.from_messages(
-        [
-            ("human", "Retrieved document: \n\n {document} \n\n User question: {question}"),
-        ]
-    )
-
-    return grade_prompt | structured_llm_grader
+    return share_connections(CohereRerank(model="rerank-english-v3.0"))
 
 
 def generate_hallucination_grader() -> Chain:
@@ -58,7 +39,7 @@ def generate_hallucination_grader() -> Chain:
     Give a binary score 'yes' or 'no'. 'Yes' means that the answer is grounded in / supported by the set of facts."""
 
     # LLM with function call
-    llm = ChatCohere(model="command-r", temperature=0)
+    llm = get_llm()
     structured_llm_grader = llm.with_structured_output(GradeHallucinations, preamble=preamble)
 
     # Prompt
@@ -91,7 +72,7 @@ def generate_answer_grader() -> Chain:
     Give a binary score 'yes' or 'no'. Yes' means that the answer resolves the question."""
 
     # LLM with function call
-    llm = ChatCohere(model="command-r", temperature=0)
+    llm = get_llm()
     structured_llm_grader = llm.with_structured_output(GradeAnswer, preamble=preamble)
 
     # Prompt
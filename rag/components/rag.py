@@ -1,9 +1,55 @@
 """Here the RAG chain is defined. This chain is used to generate answers based on retrieved documents."""
+import functools
+import hashlib
+
+import tiktoken
 from langchain.chains.base import Chain
-from langchain_cohere import ChatCohere
-from langchain_core.messages import HumanMessage
+from langchain_core.documents import Document
+from langchain_core.messages import BaseMessage, HumanMessage
 from langchain_core.output_parsers import StrOutputParser
-from langchain_core.prompts import ChatPromptTemplate
+
+from rag.components.client import get_llm
+
+MAX_CONTEXT_TOKENS = 3000
+
+
+@functools.cache
+def get_encoding() -> tiktoken.Encoding:
+    """Get the tokenizer used to estimate the prompt size."""
+    return tiktoken.get_encoding("cl100k_base")
+
+
+def prepare_documents(documents: list[Document], max_tokens: int = MAX_CONTEXT_TOKENS) -> list[Document]:
+    """Remove duplicate documents and limit the documents to a token budget.
+
+    The documents are kept in their order, the first document is always kept even if it exceeds the budget.
+
+    Args:
+    ----
+        documents (list[Document]): Documents for the RAG chain
+        max_tokens (int): Token budget for all documents
+
+    Returns:
+    -------
+        list[Document]: Unique documents within the token budget
+
+    """
+    encoding = get_encoding()
+    seen = set()
+    prepared = []
+    tokens = 0
+    for d in documents:
+        digest = hashlib.blake2b(d.page_content.encode(), digest_size=16).digest()
+        if digest in seen:
+            continue
+        seen.add(digest)
+
+        # Retrieved and web texts may contain special tokens like <|endoftext|>, they are counted as plain text
+        tokens += len(encoding.encode(d.page_content, disallowed_special=()))
+        if prepared and tokens > max_tokens:
+            break
+        prepared.append(d)
+    return prepared
 
 
 def generate_rag_chain() -> Chain:
@@ -12,11 +58,11 @@ def generate_rag_chain() -> Chain:
     preamble = """You are an assistant for question-answering tasks. Use the following pieces of retrieved context to answer the question. If you don't know the answer, just say that you don't know. Use three sentences maximum and keep the answer concise."""
 
     # LLM
-    llm = ChatCohere(model_name="command-r", temperature=0).bind(preamble=preamble)
+    llm = get_llm().bind(preamble=preamble)
 
-    # Prompt
-    def prompt(x: dict) -> ChatPromptTemplate:
-        return ChatPromptTemplate.from_messages([HumanMessage(f"Question: {x['question']} \nAnswer: ", additional_kwargs={"documents": x["documents"]})])
+    # Prompt, the message is passed to the LLM directly instead of building and invoking a prompt template per call
+    def prompt(x: dict) -> list[BaseMessage]:
+        return [HumanMessage(f"Question: {x['question']} \nAnswer: ", additional_kwargs={"documents": x["documents"]})]
 
     # Chain
     return prompt | llm | StrOutputParser()
@@ -1,33 +1,120 @@
 """Here the router chain is defined. This chain is used to route a user question to a vectorstore or web search."""
+from collections.abc import Callable, Sequence
+from typing import ClassVar
+
+import numpy as np
 from langchain.chains.base import Chain
-from langchain_cohere import ChatCohere
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.pydantic_v1 import BaseModel, Field
 
+from rag.components.client import get_llm
+from rag.components.vdb import embed_query, get_embeddings
 
-def generate_question_router() -> Chain:
-    """Generates a router chain to route a user question to a vectorstore or web search."""
+# Minimum difference between the cosine similarities of the two closest datasources, below it the LLM router decides. The value
+# is not checked against the real embeddings yet, tune it with the labeled questions in tests/test_router.py before enabling the
+# embedding router, a misrouted question costs more than an LLM router call.
+ROUTER_MARGIN = 0.05
+
+# Topics of the vectorstore, shared by the LLM router preamble and the embedding router
+VECTORSTORE_TOPICS = "stackits information about nvidia installation, gpu virtualmaschines and the general cloud plattform faq"
+
+# Descriptions of the graph routes, the question is routed to the most similar one
+DATASOURCE_DESCRIPTIONS = {
+    "vectorstore": f"documents related to {VECTORSTORE_TOPICS}",
+    "web_search": "general knowledge questions about any other topic like finance, news, science, people, places, products or programming",
+    "llm_fallback": "greetings, small talk, thanks and questions about the assistant itself that need no documents or search",
+}
+
+
+# Data model
+class WebSearch(BaseModel):
+
+    """Tool to search the internet, the description for the LLM is built from the vectorstore topics."""
+
+    query: str = Field(description="The query to use when searching the internet.")
+
+    class Config:
+
+        """Description of the tool for the LLM."""
+
+        schema_extra: ClassVar[dict[str, str]] = {
+            "description": f"The internet. Use web_search for questions that are related to anything else than related to {VECTORSTORE_TOPICS}."
+        }
+
+
+class Vectorstore(BaseModel):
+
+    """Tool to search the vectorstore, the description for the LLM is built from the vectorstore topics."""
 
-    # Data model
-    class WebSearch(BaseModel):
+    query: str = Field(description="The query to use when searching the vectorstore.")
 
-        """The internet. Use web_search for questions that are related to anything else than related to stackits information about nvidia installation, gpu virtualmaschines and the general cloud plattform faq."""
+    class Config:
 
-        query: str = Field(description="The query to use when searching the internet.")
+        """Description of the tool for the LLM."""
 
-    class Vectorstore(BaseModel):
+        schema_extra: ClassVar[dict[str, str]] = {
+            "description": f"A vectorstore containing documents related to {VECTORSTORE_TOPICS}. Use the vectorstore for questions on these topics."
+        }
 
-        """A vectorstore containing documents related to stackits information about nvidia installation, gpu virtualmaschines and the general cloud plattform faq. Use the vectorstore for questions on these topics."""
 
-        query: str = Field(description="The query to use when searching the vectorstore.")
+class EmbeddingRouter:
 
+    """Router that compares the question embedding to embeddings of the datasource descriptions.
+
+    If the two most similar datasources are closer than the margin the router is not sure and returns None.
+    """
+
+    def __init__(self, vectors: np.ndarray, datasources: list[str], embed_query: Callable[[str], Sequence[float]], margin: float = ROUTER_MARGIN) -> None:
+        """Initialize the router.
+
+        Args:
+        ----
+            vectors (np.ndarray): Embeddings of the datasource descriptions
+            datasources (list[str]): Names of the datasources in the order of the vectors
+            embed_query (Callable[[str], Sequence[float]]): Function to embed the questions
+            margin (float): Minimum difference between the two highest similarities
+
+        """
+        self.vectors = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+        self.datasources = datasources
+        self.embed_query = embed_query
+        self.margin = margin
+
+    def route(self, question: str) -> str | None:
+        """Route a question to a datasource.
+
+        Args:
+        ----
+            question (str): The user question
+
+        Returns:
+        -------
+            str | None: Name of the datasource, None if the router is not sure
+
+        """
+        vector = np.asarray(self.embed_query(question), dtype=np.float32)
+        similarities = self.vectors @ (vector / np.linalg.norm(vector))
+        second, best = np.argsort(similarities)[-2:]
+        if similarities[best] - similarities[second] < self.margin:
+            return None
+        return self.datasources[best]
+
+
+def generate_embedding_router(margin: float = ROUTER_MARGIN) -> EmbeddingRouter:
+    """Generates a router to route a user question to a vectorstore, web search or the LLM fallback by embedding similarity."""
+    vectors = np.asarray(get_embeddings().embed_documents(list(DATASOURCE_DESCRIPTIONS.values())), dtype=np.float32)
+    return EmbeddingRouter(vectors=vectors, datasources=list(DATASOURCE_DESCRIPTIONS), embed_query=embed_query, margin=margin)
+
+
+def generate_question_router() -> Chain:
+    """Generates a router chain to route a user question to a vectorstore or web search."""
     # Preamble
-    preamble = """You are an expert at routing a user question to a vectorstore or web search.
-    The vectorstore contains documents related to stackits information about nvidia installation, gpu virtualmaschines and the general cloud plattform faq.
+    preamble = f"""You are an expert at routing a user question to a vectorstore or web search.
+    The vectorstore contains documents related to {VECTORSTORE_TOPICS}.
     Use the vectorstore for questions on these topics. Otherwise, use web-search."""
 
     # LLM with tool use and preamble
-    llm = ChatCohere(model="command-r", temperature=0)
+    llm = get_llm()
     structured_llm_router = llm.bind_tools(tools=[WebSearch, Vectorstore], preamble=preamble)
 
     # Prompt
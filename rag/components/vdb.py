@@ -1,15 +1,111 @@
 """Here the vectorstore is defined. This vectorstore is used to store and retrieve documents."""
-from langchain.chains.base import Chain
+import functools
+import hashlib
+import pickle
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+from pathlib import Path
+from uuid import uuid4
+
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_cohere import CohereEmbeddings
 from langchain_community.document_loaders import WebBaseLoader
 from langchain_community.vectorstores import Chroma
+from langchain_core.documents import Document
+
+from rag.components.cache import SemanticRetrieverCache
+from rag.components.client import share_connections
+
+PERSIST_DIRECTORY = Path(".chroma")
+BUILD_DIRECTORY = Path(".chroma.tmp")
+SPLITS_DIRECTORY = Path(".splits")
+CHUNK_SIZE = 512
+CHUNK_OVERLAP = 100
+EMBED_BATCH_SIZE = 96  # maximum number of texts per Cohere embed request
+# Compare the Cohere embeddings by cosine distance, the other HNSW parameters keep the Chroma defaults until they are measured
+HNSW_METADATA = {"hnsw:space": "cosine"}
+
+
+@functools.cache
+def get_embeddings() -> CohereEmbeddings:
+    """Get the shared embeddings model."""
+    return share_connections(CohereEmbeddings())
+
+
+@functools.lru_cache(maxsize=256)
+def embed_query(question: str) -> tuple[float, ...]:
+    """Embed a question, the cache lets the router and the retriever share one embed request per question."""
+    return tuple(get_embeddings().embed_query(question))
+
+
+def embed_in_batches(embd: CohereEmbeddings, texts: list[str], batch_size: int = EMBED_BATCH_SIZE) -> list[list[float]]:
+    """Embed documents with one embed request per batch, the batches are sent concurrently.
+
+    Args:
+    ----
+        embd (CohereEmbeddings): Embeddings model
+        texts (list[str]): Texts to embed
+        batch_size (int): Number of texts per embed request
+
+    Returns:
+    -------
+        list[list[float]]: Embeddings in the order of the texts
+
+    """
+    batches = [texts[i : i + batch_size] for i in range(0, len(texts), batch_size)]
+    with ThreadPoolExecutor(max_workers=max(len(batches), 1)) as executor:
+        return list(chain.from_iterable(executor.map(embd.embed_documents, batches)))
 
 
-def load_vdb_retriver() -> Chain:
+def split_documents(docs_list: list[Document]) -> list[Document]:
+    """Split the documents into chunks, the chunks are cached on disk by a hash of the documents and the splitter settings.
+
+    Args:
+    ----
+        docs_list (list[Document]): Documents to split
+
+    Returns:
+    -------
+        list[Document]: Chunks of the documents
+
+    """
+    # The key covers the splitter settings and each document, length prefixed so that different documents can not collide
+    key = hashlib.blake2b(f"{CHUNK_SIZE}:{CHUNK_OVERLAP}".encode())
+    for d in docs_list:
+        content = d.page_content.encode()
+        key.update(len(content).to_bytes(8, "little"))
+        key.update(content)
+    splits_path = SPLITS_DIRECTORY / f"{key.hexdigest()}.pkl"
+    if splits_path.exists():
+        with splits_path.open("rb") as f:
+            return pickle.load(f)  # noqa: S301
+
+    text_splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+    doc_splits = text_splitter.split_documents(docs_list)
+
+    # Only the splits of the current documents are kept, this also removes a partial file left by a crash
+    SPLITS_DIRECTORY.mkdir(exist_ok=True)
+    for stale_path in SPLITS_DIRECTORY.iterdir():
+        stale_path.unlink()
+
+    # Write to a temporary file and move it in place once it is complete, a crash must not leave a truncated file under the key
+    temporary_path = splits_path.with_suffix(".tmp")
+    with temporary_path.open("wb") as f:
+        pickle.dump(doc_splits, f)
+    temporary_path.replace(splits_path)
+    return doc_splits
+
+
+def load_vdb_retriver() -> SemanticRetrieverCache:
     """Load the vectorstore retriever."""
     # Set embeddings
-    embd = CohereEmbeddings()
+    embd = get_embeddings()
+
+    # Reuse the persisted index, this skips loading, splitting and embedding the docs
+    if PERSIST_DIRECTORY.exists():
+        vectorstore = Chroma(persist_directory=str(PERSIST_DIRECTORY), embedding_function=embd)
+        return SemanticRetrieverCache(vectorstore=vectorstore, embed_query=embed_query)
 
     # Docs to index
     urls = [
@@ -18,18 +114,28 @@ def load_vdb_retriver() -> Chain:
         "https://docs.stackit.cloud/stackit/en/faq-known-issues-of-ske-28476393.html",
     ]
 
-    # Load
-    docs = [WebBaseLoader(url).load() for url in urls]
+    # Load all urls concurrently
+    with ThreadPoolExecutor(max_workers=len(urls)) as executor:
+        docs = list(executor.map(lambda url: WebBaseLoader(url).load(), urls))
     docs_list = [item for sublist in docs for item in sublist]
 
     # Split
-    text_splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(chunk_size=512, chunk_overlap=100)
-    doc_splits = text_splitter.split_documents(docs_list)
+    doc_splits = split_documents(docs_list)
+
+    # Embed in batches before anything is written, a failed embed request leaves no index behind
+    texts = [d.page_content for d in doc_splits]
+    embeddings = embed_in_batches(embd, texts)
 
-    # Add to vectorstore
-    vectorstore = Chroma.from_documents(
-        documents=doc_splits,
-        embedding=embd,
+    # Build the index in a temporary directory and move it in place once it is complete
+    shutil.rmtree(BUILD_DIRECTORY, ignore_errors=True)
+    vectorstore = Chroma(embedding_function=embd, persist_directory=str(BUILD_DIRECTORY), collection_metadata=HNSW_METADATA)
+    vectorstore._collection.add(  # noqa: SLF001
+        ids=[str(uuid4()) for _ in texts],
+        embeddings=embeddings,
+        documents=texts,
+        metadatas=[d.metadata for d in doc_splits],
     )
+    BUILD_DIRECTORY.rename(PERSIST_DIRECTORY)
 
-    return vectorstore.as_retriever()
+    vectorstore = Chroma(persist_directory=str(PERSIST_DIRECTORY), embedding_function=embd)
+    return SemanticRetrieverCache(vectorstore=vectorstore, embed_query=embed_query)
@@ -1,33 +1,115 @@
 """Main RAG Graph."""
 
+import asyncio
+import contextlib
+import functools
+import os
+import threading
+from collections.abc import Callable
+from typing import TypeVar
+
 from dotenv import load_dotenv
+from langchain.chains.base import Chain
 from langchain.schema import Document
+from langchain_cohere import CohereRerank
 from langchain_community.tools.tavily_search import TavilySearchResults
 from langgraph.graph import END, StateGraph
+from langgraph.graph.state import CompiledStateGraph
 from loguru import logger
 from typing_extensions import TypedDict
 
+from rag.components.cache import SemanticRetrieverCache
 from rag.components.fallback import generate_fallback_chain
 from rag.components.grader import generate_answer_grader, generate_document_grader, generate_hallucination_grader
-from rag.components.rag import generate_rag_chain
-from rag.components.router import generate_question_router
+from rag.components.rag import generate_rag_chain, get_encoding, prepare_documents
+from rag.components.router import ROUTER_MARGIN as DEFAULT_ROUTER_MARGIN
+from rag.components.router import EmbeddingRouter, Vectorstore, WebSearch, generate_embedding_router, generate_question_router
 from rag.components.vdb import load_vdb_retriver
 
 load_dotenv()
 
-# Setup the necessary components
-retriever = load_vdb_retriver()
-question_router = generate_question_router()
-rag_chain = generate_rag_chain()
-llm_chain = generate_fallback_chain()
+# Minimum Cohere rerank relevance score (0 to 1) for a document to count as relevant. The default is deliberately low
+# to stay as lenient as the former LLM grader, which accepted any document sharing keywords or meaning with the question.
+RELEVANCE_THRESHOLD = float(os.getenv("RELEVANCE_THRESHOLD", "0.1"))
+MAX_RELEVANT_DOCUMENTS = 4
+# Route by embedding similarity before asking the LLM router. Off by default until the router margin is checked against the
+# labeled questions in tests/test_router.py with the real embeddings.
+EMBEDDING_ROUTING = os.getenv("EMBEDDING_ROUTING", "false").lower() == "true"
+ROUTER_MARGIN = float(os.getenv("ROUTER_MARGIN", str(DEFAULT_ROUTER_MARGIN)))
+# Run the answer grader next to the hallucination grader. This saves one grader round trip on grounded answers, but a
+# generation that is not grounded pays for an answer grade that is thrown away.
+SPECULATIVE_GRADING = os.getenv("SPECULATIVE_GRADING", "true").lower() == "true"
+
+T = TypeVar("T")
+
+
+def singleton(factory: Callable[[], T]) -> Callable[[], T]:
+    """Cache the result of a factory, the lock makes sure it is only created once when called from several threads."""
+    lock = threading.Lock()
+    cached_factory = functools.cache(factory)
+
+    @functools.wraps(factory)
+    def wrapper() -> T:
+        with lock:
+            return cached_factory()
+
+    return wrapper
+
+
+# Setup the necessary components lazily, so only the chains a request hits are created
+@singleton
+def get_retriever() -> SemanticRetrieverCache:
+    """Get the vectorstore retriever."""
+    return load_vdb_retriver()
+
+
+@singleton
+def get_question_router() -> Chain:
+    """Get the question router chain."""
+    return generate_question_router()
+
+
+@singleton
+def get_embedding_router() -> EmbeddingRouter:
+    """Get the embedding router."""
+    return generate_embedding_router(margin=ROUTER_MARGIN)
+
+
+@singleton
+def get_rag_chain() -> Chain:
+    """Get the RAG chain."""
+    return generate_rag_chain()
+
+
+@singleton
+def get_llm_chain() -> Chain:
+    """Get the fallback chain."""
+    return generate_fallback_chain()
+
 
 # define graders
-retrieval_grader = generate_document_grader()
-hallucination_grader = generate_hallucination_grader()
-answer_grader = generate_answer_grader()
+@singleton
+def get_retrieval_grader() -> CohereRerank:
+    """Get the document grader chain."""
+    return generate_document_grader()
+
+
+@singleton
+def get_hallucination_grader() -> Chain:
+    """Get the hallucination grader chain."""
+    return generate_hallucination_grader()
+
+
+@singleton
+def get_answer_grader() -> Chain:
+    """Get the answer grader chain."""
+    return generate_answer_grader()
 
 
-web_search_tool = TavilySearchResults()
+@singleton
+def get_web_search_tool() -> TavilySearchResults:
+    """Get the web search tool."""
+    return TavilySearchResults()
 
 
 class RouterError(Exception):
@@ -67,10 +149,16 @@ def retrieve(state: GraphState) -> dict:
     question = state["question"]
 
     # Retrieval
-    documents = retriever.invoke(question)
+    documents = get_retriever().invoke(question)
     return {"documents": documents, "question": question}
 
 
+@functools.lru_cache(maxsize=256)
+def fallback_answer(question: str) -> str:
+    """Generate and cache the answer of the LLM w/o vectorstore for a question."""
+    return get_llm_chain().invoke({"question": question})
+
+
 def llm_fallback(state: GraphState) -> dict:
     """Generate answer using the LLM w/o vectorstore.
 
@@ -84,11 +172,11 @@ def llm_fallback(state: GraphState) -> dict:
 
     """
     question = state["question"]
-    generation = llm_chain.invoke({"question": question})
+    generation = fallback_answer(question)
     return {"question": question, "generation": generation}
 
 
-def generate(state: GraphState) -> dict:
+async def generate(state: GraphState) -> dict:
     """Generate answer using the vectorstore.
 
     Args:
@@ -106,7 +194,10 @@ def generate(state: GraphState) -> dict:
         documents = [documents]
 
     # RAG generation
-    generation = rag_chain.invoke({"documents": documents, "question": question})
+    documents = prepare_documents(documents)
+    async with contextlib.aclosing(get_rag_chain().astream({"documents": documents, "question": question})) as stream:
+        chunks = [chunk async for chunk in stream]
+    generation = "".join(chunks)
     return {"documents": documents, "question": question, "generation": generation}
 
 
@@ -124,19 +215,22 @@ def grade_documents(state: GraphState) -> dict:
     """
     question = state["question"]
     documents = state["documents"]
+    if not documents:
+        return {"documents": [], "question": question}
 
-    # Score each doc
-    filtered_docs = []
-    for d in documents:
-        score = retrieval_grader.invoke({"question": question, "document": d.page_content})
-        grade = score.binary_score
-        if grade == "yes":
-            filtered_docs.append(d)
-        else:
-            continue
+    # Score all docs with one rerank request, only the most relevant docs are returned
+    results = get_retrieval_grader().rerank(documents=[d.page_content for d in documents], query=question, top_n=MAX_RELEVANT_DOCUMENTS)
+    filtered_docs = [documents[r["index"]] for r in results if r["relevance_score"] >= RELEVANCE_THRESHOLD]
     return {"documents": filtered_docs, "question": question}
 
 
+def search_web(question: str) -> Document:
+    """Search the web and combine the results into one document."""
+    docs = get_web_search_tool().invoke({"query": question})
+    web_results = "\n".join([d["content"] for d in docs])
+    return Document(page_content=web_results)
+
+
 def web_search(state: GraphState) -> dict:
     """Web search based on the re-phrased question.
 
@@ -152,13 +246,31 @@ def web_search(state: GraphState) -> dict:
     question = state["question"]
 
     # Web search
-    docs = web_search_tool.invoke({"query": question})
-    web_results = "\n".join([d["content"] for d in docs])
-    web_results = Document(page_content=web_results)
+    web_results = search_web(question)
 
     return {"documents": web_results, "question": question}
 
 
+async def hybrid_search(state: GraphState) -> dict:
+    """Retrieve documents from the vectorstore and the web in parallel, used when the router can not decide on one source.
+
+    Args:
+    ----
+        state (dict): The current graph state
+
+    Returns:
+    -------
+        state (dict): Updates documents key with the retrieved documents and web results
+
+    """
+    question = state["question"]
+
+    # Retrieval and web search
+    documents, web_results = await asyncio.gather(asyncio.to_thread(lambda: get_retriever().invoke(question)), asyncio.to_thread(search_web, question))
+
+    return {"documents": [*documents, web_results], "question": question}
+
+
 ### Edges ###
 
 
@@ -175,7 +287,11 @@ def route_question(state: GraphState) -> str:
 
     """
     question = state["question"]
-    source = question_router.invoke({"question": question})
+
+    # Route by embedding similarity if enabled, only ask the LLM router if that is not clear
+    if EMBEDDING_ROUTING and (datasource := get_embedding_router().route(question)) is not None:
+        return datasource
+    source = get_question_router().invoke({"question": question})
 
     # Fallback to LLM or raise error if no decision
     if "tool_calls" not in source.additional_kwargs:
@@ -184,11 +300,14 @@ def route_question(state: GraphState) -> str:
         msg = "Router could not decide source"
         raise RouterError(msg)
 
-    # Choose datasource
+    # Choose datasource, search both if the router called both, the tools are named after their classes
+    datasources = {tool_call["function"]["name"] for tool_call in source.additional_kwargs["tool_calls"]}
+    if {WebSearch.__name__, Vectorstore.__name__} <= datasources:
+        return "hybrid"
     datasource = source.additional_kwargs["tool_calls"][0]["function"]["name"]
-    if datasource == "web_search":
+    if datasource == WebSearch.__name__:
         return "web_search"
-    elif datasource == "vectorstore":
+    elif datasource == Vectorstore.__name__:
         return "vectorstore"
     else:
         return "vectorstore"
@@ -218,9 +337,11 @@ def decide_to_generate(state: GraphState) -> str:
         return "generate"
 
 
-def grade_generation_v_documents_and_question(state: GraphState) -> str:
+async def grade_generation_v_documents_and_question(state: GraphState) -> str:
     """Determines whether the generation is grounded in the document and answers question.
 
+    With SPECULATIVE_GRADING the answer grader is started next to the hallucination grader and its result is discarded if the generation is not grounded.
+
     Args:
     ----
         state (dict): The current graph state
@@ -234,84 +355,125 @@ def grade_generation_v_documents_and_question(state: GraphState) -> str:
     documents = state["documents"]
     generation = state["generation"]
 
-    score = hallucination_grader.invoke({"documents": documents, "generation": generation})
-    grade = score.binary_score
+    # ChatCohere.ainvoke calls the sync Cohere client and would block the event loop, so the graders run in threads to overlap
+    answer_input = {"question": question, "generation": generation}
+    answer_task = asyncio.create_task(asyncio.to_thread(get_answer_grader().invoke, answer_input)) if SPECULATIVE_GRADING else None
+    try:
+        # Check hallucination
+        score = await asyncio.to_thread(get_hallucination_grader().invoke, {"documents": documents, "generation": generation})
+        if score.binary_score != "yes":
+            logger.info("---DECISION: GENERATION IS NOT GROUNDED IN DOCUMENTS, RE-TRY---")
+            return "not supported"
 
-    # Check hallucination
-    if grade == "yes":
         # Check question-answering
-        score = answer_grader.invoke({"question": question, "generation": generation})
-        grade = score.binary_score
-        if grade == "yes":
-            return "useful"
-        else:
-            return "not useful"
+        score = await answer_task if answer_task is not None else await asyncio.to_thread(get_answer_grader().invoke, answer_input)
+    finally:
+        # A discarded answer grade is not awaited, the request in the thread still finishes but its result and error are dropped
+        if answer_task is not None:
+            answer_task.add_done_callback(lambda task: task.cancelled() or task.exception())
+            answer_task.cancel()
+    grade = score.binary_score
+    if grade == "yes":
+        return "useful"
     else:
-        logger.info("---DECISION: GENERATION IS NOT GROUNDED IN DOCUMENTS, RE-TRY---")
-        return "not supported"
-
-
-workflow = StateGraph(GraphState)
-
-# Define the nodes
-workflow.add_node("web_search", web_search)  # web search
-workflow.add_node("retrieve", retrieve)  # retrieve
-workflow.add_node("grade_documents", grade_documents)  # grade documents
-workflow.add_node("generate", generate)  # rag
-workflow.add_node("llm_fallback", llm_fallback)  # llm
-
-# Build graph
-workflow.set_conditional_entry_point(
-    route_question,
-    {
-        "web_search": "web_search",
-        "vectorstore": "retrieve",
-        "llm_fallback": "llm_fallback",
-    },
-)
-workflow.add_edge("web_search", "generate")
-workflow.add_edge("retrieve", "grade_documents")
-workflow.add_conditional_edges(
-    "grade_documents",
-    decide_to_generate,
-    {
-        "web_search": "web_search",
-        "generate": "generate",
-    },
-)
-workflow.add_conditional_edges(
-    "generate",
-    grade_generation_v_documents_and_question,
-    {
-        "not supported": "generate",  # Hallucinations: re-generate
-        "not useful": "web_search",  # Fails to answer question: fall-back to web-search
-        "useful": END,
-    },
-)
-workflow.add_edge("llm_fallback", END)
-
-# Compile
-app = workflow.compile()
-
-# Run
-inputs = {"question": "Can you give me the necessary stepts to  install nvidia on stackit?"}
+        return "not useful"
+
+
+@singleton
+def get_app() -> CompiledStateGraph:
+    """Get the compiled graph, it is shared by all threads and requests."""
+    workflow = StateGraph(GraphState)
+
+    # Define the nodes
+    workflow.add_node("web_search", web_search)  # web search
+    workflow.add_node("retrieve", retrieve)  # retrieve
+    workflow.add_node("hybrid_search", hybrid_search)  # retrieve and web search
+    workflow.add_node("grade_documents", grade_documents)  # grade documents
+    workflow.add_node("generate", generate)  # rag
+    workflow.add_node("llm_fallback", llm_fallback)  # llm
+
+    # Build graph
+    workflow.set_conditional_entry_point(
+        route_question,
+        {
+            "web_search": "web_search",
+            "vectorstore": "retrieve",
+            "hybrid": "hybrid_search",
+            "llm_fallback": "llm_fallback",
+        },
+    )
+    workflow.add_edge("web_search", "generate")
+    workflow.add_edge("retrieve", "grade_documents")
+    workflow.add_edge("hybrid_search", "grade_documents")
+    workflow.add_conditional_edges(
+        "grade_documents",
+        decide_to_generate,
+        {
+            "web_search": "web_search",
+            "generate": "generate",
+        },
+    )
+    workflow.add_conditional_edges(
+        "generate",
+        grade_generation_v_documents_and_question,
+        {
+            "not supported": "generate",  # Hallucinations: re-generate
+            "not useful": "web_search",  # Fails to answer question: fall-back to web-search
+            "useful": END,
+        },
+    )
+    workflow.add_edge("llm_fallback", END)
+
+    # Compile
+    return workflow.compile()
+
+
+async def warmup() -> None:
+    """Warm up the graph.
+
+    Creates all components, loads the tokenizer and compiles the graph in a worker thread, so the index is loaded or built and the
+    tokenizer is downloaded before the first request and concurrent requests do not wait on each other for it. The tokenizer would
+    otherwise be loaded by the first generate call on the event loop. No question is run, which would cost paid LLM and web search calls.
+    """
 
-# for output in app.stream(inputs):
-#     for key, value in output.items():
-#         # Node
-#         logger.info(f"Node '{key}':")
-#         # Optional: print full state at each node
-#         # logger.info(value["keys"], indent=2, width=80, depth=None)
+    def create_components() -> None:
+        for get_component in (
+            get_retriever,
+            *((get_embedding_router,) if EMBEDDING_ROUTING else ()),
+            get_question_router,
+            get_rag_chain,
+            get_encoding,
+            get_llm_chain,
+            get_retrieval_grader,
+            get_hallucination_grader,
+            get_answer_grader,
+            get_web_search_tool,
+            get_app,
+        ):
+            get_component()
+
+    await asyncio.to_thread(create_components)
 
-# # Final generation
-# logger.info(value["generation"])
 
+# Run
+async def main() -> None:
+    """Run the graph for the sample questions concurrently."""
+    inputs = [
+        {"question": "Can you give me the necessary stepts to  install nvidia on stackit?"},
+        {"question": "What is an ETF?"},
+    ]
+    await warmup()
+    # A failing question must not discard the answers of the others
+    results = await asyncio.gather(*(get_app().ainvoke(question) for question in inputs), return_exceptions=True)
+
+    # Final generations
+    for question, result in zip(inputs, results, strict=True):
+        if isinstance(result, Exception):
+            logger.opt(exception=result).error(f"Question '{question['question']}' failed")
+            continue
+        logger.info(f"Question '{question['question']}':")
+        logger.info(result["generation"])
 
-inputs = {"question": "What is an ETF?"}
-for output in app.stream(inputs):
-    for key, value in output.items():
-        # Node
-        logger.info(f"Node '{key}':")
 
-# Final generation
-logger.info(value["generation"])
+if __name__ == "__main__":
+    asyncio.run(main())
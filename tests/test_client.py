@@ -0,0 +1,56 @@
+"""Tests for the shared Cohere connection pools."""
+import asyncio
+import threading
+from collections.abc import Iterator
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+import pytest
+
+from rag.components.client import EventLoopTransport
+
+
+class Handler(BaseHTTPRequestHandler):
+
+    """Answer every request with an empty response and keep the connection open."""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self) -> None:  # noqa: N802
+        """Answer a GET request."""
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *_: object) -> None:
+        """Do not log the requests."""
+
+
+@pytest.fixture()
+def url() -> Iterator[str]:
+    """Start a local HTTP server."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}/"
+    server.shutdown()
+    server.server_close()
+
+
+def test_several_event_loops(url: str) -> None:
+    """The client can be used by one event loop after another and by event loops in several threads."""
+    client = httpx.AsyncClient(transport=EventLoopTransport())
+
+    async def get() -> int:
+        return (await client.get(url)).status_code
+
+    assert asyncio.run(get()) == 200
+    assert asyncio.run(get()) == 200
+
+    status_codes = []
+    threads = [threading.Thread(target=lambda: status_codes.append(asyncio.run(get()))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert status_codes == [200] * 4
@@ -0,0 +1,72 @@
+"""Tests for grading a generation against the documents and the question."""
+import asyncio
+import threading
+from collections.abc import Callable
+from types import SimpleNamespace
+
+import pytest
+
+from rag import main
+
+STATE = {"question": "question", "documents": [], "generation": "generation"}
+
+
+class FakeGrader:
+
+    """Grader that records its calls and returns a fixed grade or raises."""
+
+    def __init__(self, grade: Callable[[], object]) -> None:
+        """Initialize the grader with a function that returns the grade."""
+        self.grade = grade
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def invoke(self, _: dict) -> object:
+        """Grade the input."""
+        with self.lock:
+            self.calls += 1
+        return self.grade()
+
+
+def grade(hallucination: FakeGrader, answer: FakeGrader, monkeypatch: pytest.MonkeyPatch, speculative: bool) -> str:
+    """Grade the generation with the fake graders."""
+    monkeypatch.setattr(main, "get_hallucination_grader", lambda: hallucination)
+    monkeypatch.setattr(main, "get_answer_grader", lambda: answer)
+    monkeypatch.setattr(main, "SPECULATIVE_GRADING", speculative)
+    return asyncio.run(main.grade_generation_v_documents_and_question(STATE))
+
+
+@pytest.mark.parametrize("speculative", [True, False])
+@pytest.mark.parametrize(
+    ("grounded", "useful", "decision"),
+    [
+        ("yes", "yes", "useful"),
+        ("yes", "no", "not useful"),
+        ("no", "yes", "not supported"),
+    ],
+)
+def test_decision(monkeypatch: pytest.MonkeyPatch, speculative: bool, grounded: str, useful: str, decision: str) -> None:
+    """The decision does not depend on whether the answer is graded speculatively."""
+    hallucination = FakeGrader(lambda: SimpleNamespace(binary_score=grounded))
+    answer = FakeGrader(lambda: SimpleNamespace(binary_score=useful))
+    assert grade(hallucination, answer, monkeypatch, speculative) == decision
+
+
+def test_no_answer_grade_without_speculation(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Without speculation a generation that is not grounded is not graded against the question."""
+    hallucination = FakeGrader(lambda: SimpleNamespace(binary_score="no"))
+    answer = FakeGrader(lambda: SimpleNamespace(binary_score="yes"))
+    grade(hallucination, answer, monkeypatch, speculative=False)
+    assert answer.calls == 0
+
+
+def test_hallucination_grader_error(monkeypatch: pytest.MonkeyPatch) -> None:
+    """An error of the hallucination grader is raised and the speculative answer grade is dropped."""
+
+    def fail() -> None:
+        msg = "grader failed"
+        raise RuntimeError(msg)
+
+    answer = FakeGrader(fail)
+    with pytest.raises(RuntimeError, match="grader failed"):
+        grade(FakeGrader(fail), answer, monkeypatch, speculative=True)
@@ -0,0 +1,33 @@
+"""Tests for preparing the documents of the RAG chain."""
+import pytest
+import tiktoken
+from langchain_core.documents import Document
+
+from rag.components import rag
+
+
+@pytest.fixture(autouse=True)
+def _byte_encoding(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Count one token per byte, the real encoding would have to be downloaded."""
+    encoding = tiktoken.Encoding(name="bytes", pat_str=r".", mergeable_ranks={bytes([i]): i for i in range(256)}, special_tokens={"<|endoftext|>": 256})
+    monkeypatch.setattr(rag, "get_encoding", lambda: encoding)
+
+
+def test_duplicates_are_removed() -> None:
+    """Documents with the same content are only kept once."""
+    documents = [Document(page_content="a"), Document(page_content="b"), Document(page_content="a")]
+    assert [d.page_content for d in rag.prepare_documents(documents)] == ["a", "b"]
+
+
+def test_token_budget() -> None:
+    """Documents after the token budget are dropped, the first document is always kept."""
+    documents = [Document(page_content="aaaa"), Document(page_content="bbbb"), Document(page_content="cc")]
+    assert [d.page_content for d in rag.prepare_documents(documents, max_tokens=6)] == ["aaaa"]
+    assert [d.page_content for d in rag.prepare_documents(documents, max_tokens=2)] == ["aaaa"]
+
+
+def test_special_tokens_are_plain_text() -> None:
+    """Texts containing special tokens do not raise but are counted as plain text."""
+    documents = [Document(page_content="a<|endoftext|>"), Document(page_content="b")]
+    assert [d.page_content for d in rag.prepare_documents(documents, max_tokens=14)] == ["a<|endoftext|>"]
+    assert [d.page_content for d in rag.prepare_documents(documents, max_tokens=15)] == ["a<|endoftext|>", "b"]
@@ -0,0 +1,71 @@
+"""Tests for routing a question to a datasource."""
+import pytest
+from cohere import ToolCall
+from langchain_cohere.chat_models import _format_cohere_tool_calls
+from langchain_cohere.cohere_agent import _convert_to_cohere_tool
+from langchain_core.messages import AIMessage
+from langchain_core.runnables import RunnableLambda
+
+from rag import main
+from rag.components.router import Vectorstore, WebSearch
+
+
+class UndecidedEmbeddingRouter:
+
+    """Embedding router that always defers to the LLM router."""
+
+    def route(self, question: str) -> None:
+        """Defer to the LLM router."""
+
+
+class VectorstoreEmbeddingRouter:
+
+    """Embedding router that always routes to the vectorstore."""
+
+    def route(self, _: str) -> str:
+        """Route to the vectorstore."""
+        return "vectorstore"
+
+
+def router_calling(*tools: type) -> RunnableLambda:
+    """Fake LLM router that calls the given tools the way ChatCohere reports them."""
+    tool_calls = [ToolCall(name=_convert_to_cohere_tool(tool)["name"], parameters={"query": "question"}) for tool in tools]
+    message = AIMessage(content="", additional_kwargs={"tool_calls": _format_cohere_tool_calls(tool_calls)})
+    return RunnableLambda(lambda _: message)
+
+
+@pytest.mark.parametrize(
+    ("tools", "route"),
+    [
+        ((WebSearch, Vectorstore), "hybrid"),
+        ((Vectorstore, WebSearch), "hybrid"),
+        ((WebSearch,), "web_search"),
+        ((Vectorstore,), "vectorstore"),
+    ],
+)
+def test_route_question_by_tool_calls(monkeypatch: pytest.MonkeyPatch, tools: tuple[type, ...], route: str) -> None:
+    """The LLM router tool calls are mapped to the graph routes."""
+    monkeypatch.setattr(main, "EMBEDDING_ROUTING", True)
+    monkeypatch.setattr(main, "get_embedding_router", UndecidedEmbeddingRouter)
+    monkeypatch.setattr(main, "get_question_router", lambda: router_calling(*tools))
+
+    assert main.route_question({"question": "question"}) == route
+
+
+def test_route_question_without_tool_calls(monkeypatch: pytest.MonkeyPatch) -> None:
+    """The LLM fallback is used if the router does not call a tool."""
+    monkeypatch.setattr(main, "EMBEDDING_ROUTING", True)
+    monkeypatch.setattr(main, "get_embedding_router", UndecidedEmbeddingRouter)
+    monkeypatch.setattr(main, "get_question_router", lambda: RunnableLambda(lambda _: AIMessage(content="Hi!")))
+
+    assert main.route_question({"question": "Hello"}) == "llm_fallback"
+
+
+@pytest.mark.parametrize(("enabled", "route"), [(True, "vectorstore"), (False, "web_search")])
+def test_embedding_routing(monkeypatch: pytest.MonkeyPatch, enabled: bool, route: str) -> None:
+    """The embedding router decides only if it is enabled."""
+    monkeypatch.setattr(main, "EMBEDDING_ROUTING", enabled)
+    monkeypatch.setattr(main, "get_embedding_router", VectorstoreEmbeddingRouter)
+    monkeypatch.setattr(main, "get_question_router", lambda: router_calling(WebSearch))
+
+    assert main.route_question({"question": "question"}) == route
@@ -0,0 +1,61 @@
+"""Tests for the embedding router."""
+import os
+
+import numpy as np
+import pytest
+
+from rag.components.router import DATASOURCE_DESCRIPTIONS, EmbeddingRouter, generate_embedding_router
+
+# Labeled questions to tune the margin against, the router may defer a question to the LLM router but must not misroute it
+LABELED_QUESTIONS = [
+    ("How do I install the nvidia drivers on a stackit gpu virtual machine?", "vectorstore"),
+    ("Which gpu types are available for virtual machines on stackit?", "vectorstore"),
+    ("Why does my stackit server not boot after a driver update?", "vectorstore"),
+    ("What are known issues of the stackit cloud platform?", "vectorstore"),
+    ("Who won the football world cup in 2014?", "web_search"),
+    ("What is the current price of gold?", "web_search"),
+    ("How do I reverse a list in python?", "web_search"),
+    ("What is the capital of Australia?", "web_search"),
+    ("Hello, how are you?", "llm_fallback"),
+    ("Thanks, that helped a lot!", "llm_fallback"),
+    ("Who are you?", "llm_fallback"),
+]
+
+
+# Fake question embeddings with one axis per datasource
+EMBEDDINGS = {
+    "gpu drivers": [1.0, 0.2, 0.1],
+    "football": [0.1, 1.0, 0.2],
+    "hello": [0.2, 0.1, 1.0],
+    "gpu prices": [1.0, 1.0, 0.0],
+    "chatbot news": [0.0, 1.0, 0.99],
+}
+
+
+@pytest.mark.parametrize(
+    ("question", "route"),
+    [
+        ("gpu drivers", "vectorstore"),
+        ("football", "web_search"),
+        ("hello", "llm_fallback"),
+        ("gpu prices", None),
+        ("chatbot news", None),
+    ],
+)
+def test_route(question: str, route: str | None) -> None:
+    """The closest datasource is chosen, close calls are left to the LLM router."""
+    router = EmbeddingRouter(vectors=np.eye(3, dtype=np.float32), datasources=["vectorstore", "web_search", "llm_fallback"], embed_query=EMBEDDINGS.__getitem__)
+    assert router.route(question) == route
+
+
+def test_routes_cover_descriptions() -> None:
+    """Every labeled route has a description the router can choose."""
+    assert {route for _, route in LABELED_QUESTIONS} == set(DATASOURCE_DESCRIPTIONS)
+
+
+@pytest.mark.skipif(not os.getenv("COHERE_API_KEY"), reason="needs the Cohere embeddings")
+def test_labeled_questions() -> None:
+    """With the default margin the router may defer to the LLM router but never misroutes a labeled question."""
+    router = generate_embedding_router()
+    misrouted = [(question, route) for question, route in LABELED_QUESTIONS if router.route(question) not in {route, None}]
+    assert misrouted == []